@@ -1,8 +1,12 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 import logging
 from routes import audio, video
+from services.extractor import startup_http_client, shutdown_http_client, startup_cookies, shutdown_cookies
+from services.ydl_pool import shutdown_pool
+from yt_dlp.version import __version__ as YTDLP_VERSION
 
 import uvicorn
 
@@ -13,11 +17,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 共有HTTPクライアント・yt-dlpプロセスプール・cookiesのライフサイクル
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup_cookies()
+    await startup_http_client()
+    yield
+    await shutdown_http_client()
+    # ワーカーがcookiesを書き終えてから書き戻す
+    shutdown_pool()
+    shutdown_cookies()
+
 # FastAPIアプリケーションの初期化
 app = FastAPI(
     title="YouTube Audio Extractor",
     description="Extract high quality audio from YouTube videos",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORSミドルウェアの設定
@@ -41,7 +57,8 @@ app.include_router(video.router, prefix="/api/v1")
 # ヘルスチェックエンドポイント
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    # サブプロセスを起動せず、読み込み済みのyt-dlpからバージョンを取得
+    return {"status": "healthy", "yt_dlp_version": YTDLP_VERSION}
 
 # ルーターのインポートと登録は後で追加
 
@@ -1,14 +1,15 @@
-from fastapi import APIRouter, HTTPException, Response
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.responses import FileResponse
 from pydantic import BaseModel, HttpUrl
-from services.extractor import AudioExtractor
-from utils.file_handler import cleanup_temp_file
+from services.extractor import AudioExtractor, get_extractor
+from utils.file_handler import cleanup_temp_file, safe_filename
 import logging
-from urllib.parse import quote, urlparse, parse_qs
+from urllib.parse import quote
 import os
 import zipfile
 from fastapi import BackgroundTasks
 import shutil
+import uuid
 from mutagen.id3 import ID3
 import asyncio  # Add this line to import the asyncio module
 
@@ -20,11 +21,51 @@ class AudioExtractionRequest(BaseModel):
     url: HttpUrl
 
 
+def _build_album_zip(album_dir: str, safe_album_title: str) -> str:
+    """アルバムディレクトリのMP3を曲名でZIPにまとめ、ZIPのパスを返す"""
+    # 保存されたファイルの確認
+    files_in_dir = os.listdir(album_dir)
+    logger.info(f"Files in album directory before ZIP: {files_in_dir}")
+
+    zip_path = f"{album_dir}.zip"
+    with zipfile.ZipFile(zip_path, 'w') as zipf:
+        for file in files_in_dir:
+            if file.endswith('.mp3'):
+                file_path = os.path.join(album_dir, file)
+                # ファイル名を曲名に変更
+                try:
+                    audio = ID3(file_path)
+                    title = audio.get('TIT2', ['Unknown Title'])[0]
+                    # 安全なファイル名に変換
+                    safe_title = safe_filename(str(title))
+                    archive_path = os.path.join(safe_album_title, f"{safe_title}.mp3")
+                except:
+                    # タグ取得に失敗した場合は元のファイル名を使用
+                    archive_path = os.path.join(safe_album_title, file)
+
+                logger.info(f"Adding to ZIP: {file_path} as {archive_path}")
+                zipf.write(file_path, archive_path)
+
+    return zip_path
+
+
+def _read_file(path: str) -> bytes:
+    """ファイルの内容を読み込む"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+
 @router.post("/extract-audio")
-async def extract_audio(request: AudioExtractionRequest):
+async def extract_audio(request: AudioExtractionRequest, http_request: Request, background_tasks: BackgroundTasks, extractor: AudioExtractor = Depends(get_extractor)):
     try:
-        extractor = AudioExtractor()
-        result = await extractor.extract(str(request.url))
+        result = await extractor.extract(
+            str(request.url),
+            if_none_match=http_request.headers.get("If-None-Match")
+        )
+        # クライアントが同じ音声を保持していれば変換せずに返す
+        # （POSTなのでRFC 9110に従いIf-None-Matchの一致は412）
+        if result.get("not_modified"):
+            return Response(status_code=412, headers={"ETag": result["etag"]})
         
         # ファイル名を適切にエンコード
         filename = result["filename"]
@@ -35,12 +76,10 @@ async def extract_audio(request: AudioExtractionRequest):
         os.makedirs(temp_dir, exist_ok=True)
         
         # 一意のファイル名を生成
-        import uuid
         cache_filename = f"{uuid.uuid4().hex}.mp3"
         cache_path = os.path.join(temp_dir, cache_filename)
         
         # ファイルをコピー
-        import shutil
         shutil.copy2(result["file_path"], cache_path)
         logger.info(f"Copied file to cache: {cache_path}")
         
@@ -56,6 +95,7 @@ async def extract_audio(request: AudioExtractionRequest):
         
         # Content-Dispositionヘッダーを明示的に設定
         response.headers["Content-Disposition"] = f'attachment; filename="{encoded_filename}"; filename*=UTF-8\'\'{encoded_filename}'
+        response.headers["ETag"] = result["etag"]
         
         # ダウンロード完了後に遅延してクリーンアップ (30秒後)
         async def delayed_cleanup():
@@ -65,6 +105,9 @@ async def extract_audio(request: AudioExtractionRequest):
         
         # バックグラウンドタスクとして実行
         asyncio.create_task(delayed_cleanup())
+
+        # 古い一時ファイルの整理はレスポンス送信後に実行
+        background_tasks.add_task(extractor.cleanup_old_files, 5)
         
         return response
 
@@ -74,22 +117,19 @@ async def extract_audio(request: AudioExtractionRequest):
 
 
 @router.post("/extract-album")
-async def extract_album(request: AudioExtractionRequest):
+async def extract_album(request: AudioExtractionRequest, extractor: AudioExtractor = Depends(get_extractor)):
     try:
-        parsed_url = urlparse(str(request.url))
-        query_params = parse_qs(parsed_url.query)
-        playlist_id = query_params.get('list', [None])[0]
+        playlist_id = extractor._extract_playlist_id(str(request.url))
 
         if playlist_id:
             playlist_url = f"https://www.youtube.com/playlist?list={playlist_id}"
             logger.info(f"Found playlist URL: {playlist_url}")
 
-            extractor = AudioExtractor()
             playlist_info = await extractor.get_playlist_info(playlist_url)
             
             # アルバムディレクトリの作成
             album_title = playlist_info.get('title', 'Unknown_Album')
-            safe_album_title = "".join(c for c in album_title if c.isalnum() or c in (' ', '-', '_')).rstrip()
+            safe_album_title = safe_filename(album_title)
             album_dir = os.path.join(extractor.temp_dir, safe_album_title)
             os.makedirs(album_dir, exist_ok=True)
             logger.info(f"Created album directory: {album_dir}")
@@ -100,44 +140,15 @@ async def extract_album(request: AudioExtractionRequest):
             # ファイルの保存を確認するためのログを追加
             saved_files = []
 
-            # 各動画を処理
-            for i, entry in enumerate(playlist_info.get('entries', []), 1):
-                video_id = entry.get('id')
-                if video_id:
-                    video_url = f"https://www.youtube.com/watch?v={video_id}"
-                    try:
-                        # album_dir を渡して、そこにファイルを保存
-                        result = await extractor.extract(video_url, output_dir=album_dir)
-                        saved_files.append(result["file_path"])
-                        logger.info(f"Saved file: {result['file_path']}")
-                    except Exception as e:
-                        logger.error(f"Error processing video {video_id}: {str(e)}")
-
-            # 保存されたファイルの確認
-            files_in_dir = os.listdir(album_dir)
-            logger.info(f"Files in album directory before ZIP: {files_in_dir}")
-
-
-            # ZIPファイルの作成
-            zip_path = f"{album_dir}.zip"
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                for file in os.listdir(album_dir):
-                    if file.endswith('.mp3'):
-                        file_path = os.path.join(album_dir, file)
-                        # ファイル名を曲名に変更
-                        try:
-                            audio = ID3(file_path)
-                            title = audio.get('TIT2', ['Unknown Title'])[0]
-                            # 安全なファイル名に変換
-                            safe_title = "".join(c for c in str(title) if c.isalnum() or c in (' ', '-', '_')).rstrip()
-                            archive_path = os.path.join(safe_album_title, f"{safe_title}.mp3")
-                        except:
-                            # タグ取得に失敗した場合は元のファイル名を使用
-                            archive_path = os.path.join(safe_album_title, file)
-                        
-                        logger.info(f"Adding to ZIP: {file_path} as {archive_path}")
-                        zipf.write(file_path, archive_path)
-                        
+            # 各動画を並行して処理（album_dir を渡して、そこにファイルを保存）
+            results = await extractor.download_playlist(playlist_url, album_dir)
+            for result in results:
+                if isinstance(result, dict):
+                    saved_files.append(result["file_path"])
+                    logger.info(f"Saved file: {result['file_path']}")
+
+            # ZIPの作成はディスクI/Oとタグ読み込みでイベントループを塞ぐのでスレッドで実行
+            zip_path = await asyncio.to_thread(_build_album_zip, album_dir, safe_album_title)
 
             # ZIP後の確認
             if os.path.exists(zip_path):
@@ -145,12 +156,10 @@ async def extract_album(request: AudioExtractionRequest):
                 logger.info(f"Created ZIP file: {zip_path}, size: {zip_size} bytes")
                 
                 # ファイルを読み込んでからクリーンアップ
-                with open(zip_path, 'rb') as f:
-                    content = f.read()
+                content = await asyncio.to_thread(_read_file, zip_path)
 
                 # クリーンアップ
-                shutil.rmtree(album_dir, ignore_errors=True)
-                os.remove(zip_path)
+                await cleanup_album_files(zip_path, album_dir)
 
                 # バイナリレスポンスを返す
                 return Response(
@@ -170,11 +179,18 @@ async def extract_album(request: AudioExtractionRequest):
         raise HTTPException(status_code=400, detail=str(e))
     
     
+@router.post("/clear-cache")
+async def clear_cache(extractor: AudioExtractor = Depends(get_extractor)):
+    """メタデータキャッシュを全削除"""
+    removed = extractor.clear_cache()
+    return {"status": "cleared", "removed": removed}
+
+
 async def cleanup_album_files(zip_path: str, album_dir: str):
     """アルバムの一時ファイルをクリーンアップする"""
     try:
         await cleanup_temp_file(zip_path)  # awaitを追加
-        import shutil
-        shutil.rmtree(album_dir)
+        # ディレクトリの削除は曲数に比例して重いのでスレッドで実行
+        await asyncio.to_thread(shutil.rmtree, album_dir, ignore_errors=True)
     except Exception as e:
         logger.error(f"Error during cleanup: {e}")
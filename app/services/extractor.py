@@ -2,56 +2,277 @@ import yt_dlp
 import os
 import asyncio
 import logging
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 from fastapi import HTTPException
-from mutagen.easyid3 import EasyID3
-from mutagen.id3 import ID3, APIC, error
-import requests
+from mutagen.id3 import ID3, ID3NoHeaderError, APIC
+import httpx
 from PIL import Image
 import io
+import urllib.parse
+import struct
+import heapq
+import re
+import functools
+import hashlib
+import json
+import shutil
+import uuid
+import tempfile
+from cachetools import LRUCache, TTLCache
+from yt_dlp.cookies import LenientSimpleCookie
+from services.metadata_cache import MetadataCache
+from services import ydl_pool
+from utils.file_handler import safe_filename
 
 logger = logging.getLogger(__name__)
 
+TEMP_DIR = "temp"
+
+# cookiesファイルパスの設定
+# リポジトリのcookiesは起動時に実行時用のパスへコピーし、yt-dlpにはコピーだけを読み書きさせる
+# （古い一時ファイルの整理で消されないよう、TEMP_DIR直下ではなくサブディレクトリに置く）
+COOKIES_SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cookies.firefox-private.txt')
+COOKIES_PATH = os.path.join(TEMP_DIR, ".cookies", "cookies.txt")
+
+# yt-dlpのログ出力: 本番環境(APP_ENV=production)では警告も抑制し、開発時は警告のみ表示
+# YDL_DEBUG=1 なら環境に関係なく詳細ログを出す
+IS_PRODUCTION = os.environ.get("APP_ENV") == "production"
+YDL_DEBUG = os.environ.get("YDL_DEBUG") == "1"
+DEBUG_YDL_OPTS = {'quiet': False, 'no_warnings': False, 'verbose': True}
+QUIET_YDL_OPTS = {'quiet': True, 'no_warnings': True, 'verbose': False}
+DEV_YDL_OPTS = {'quiet': True, 'no_warnings': False, 'verbose': False}
+YDL_LOG_OPTS = DEBUG_YDL_OPTS if YDL_DEBUG else QUIET_YDL_OPTS if IS_PRODUCTION else DEV_YDL_OPTS
+
+# メタデータ取得用の設定（ダウンロードはFFmpegで行うため、サムネイル・字幕・後処理・待機は不要）
+# _download_and_convert が info['url'] を使うため format は必須
+METADATA_OPTS = {
+    'format': 'bestaudio/best',
+    'cookiefile': COOKIES_PATH,
+    'extract_flat': True,
+    'noplaylist': False,
+    'skip_download': True,
+    'writesubtitles': False,
+    'writeautomaticsub': False,
+    'writethumbnail': False,
+    'geo_bypass': True,
+    'geo_bypass_country': 'US',
+    # より一般的なユーザーエージェントに変更
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Accept-Language': 'en-US,en;q=0.9',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    },
+    **YDL_LOG_OPTS,
+}
+
+# プレイリスト情報用の設定
+PLAYLIST_OPTS = {
+    **METADATA_OPTS,
+    'extract_flat': True,  # プレイリスト情報のみを取得
+    'noplaylist': False    # プレイリストを許可
+}
+
+# プレイリストのタイトル取得用の設定（先頭1件だけ列挙）
+PLAYLIST_META_OPTS = {
+    **PLAYLIST_OPTS,
+    'playlist_items': '1',
+    'skip_download': True,
+}
+
+# 単一動画情報用の設定
+VIDEO_OPTS = {
+    **METADATA_OPTS,
+    'extract_flat': False,
+    'noplaylist': True,
+}
+
+# FFmpegの実行パスと固定引数（起動時に1度だけ解決・構築）
+FFMPEG_BIN = shutil.which('ffmpeg') or 'ffmpeg'
+FFMPEG_INPUT_ARGS = (FFMPEG_BIN, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y')
+FFMPEG_OUTPUT_ARGS = ('-vn', '-ar', '44100', '-ac', '2', '-b:a', '320k', '-id3v2_version', '3', '-f', 'mp3')
+
+# プレイリスト処理時に同時に変換する動画数
+PLAYLIST_CONCURRENCY = int(os.environ.get("PLAYLIST_CONCURRENCY", "4"))
+
+# アートワークの最大辺（MP3のアルバムアートには600px四方で十分）
+COVER_MAX_SIZE = 600
+
+# これ以下のサイズのサムネイルはプレースホルダーとみなす
+MIN_THUMBNAIL_BYTES = 2048
+
+# サムネイル取得用の共有HTTPクライアント（起動時に生成、終了時にクローズ）
+_HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """共有HTTPクライアントを取得（未生成なら生成）"""
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None or _HTTP_CLIENT.is_closed:
+        _HTTP_CLIENT = httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=httpx.Timeout(5.0),
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=4),
+            headers={'User-Agent': METADATA_OPTS['http_headers']['User-Agent']},
+        )
+    return _HTTP_CLIENT
+
+
+# 採用したサムネイルURLごとの (ETag, 画像バイト列)。再取得時は条件付きGETで304なら再利用
+# 1枚100〜250KBあるので、アートワークのキャッシュから外れた分を補う程度の件数に抑える
+_THUMBNAIL_CACHE: TTLCache = TTLCache(maxsize=32, ttl=86400)
+
+# 動画IDごとのクロップ・エンコード済みアートワーク（再抽出時は取得も変換も省く）
+_COVER_CACHE: LRUCache = LRUCache(maxsize=64)
+
+
+async def startup_http_client() -> None:
+    """アプリ起動時に共有HTTPクライアントを生成"""
+    _get_http_client()
+
+
+async def shutdown_http_client() -> None:
+    """アプリ終了時に共有HTTPクライアントをクローズ"""
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is not None:
+        await _HTTP_CLIENT.aclose()
+        _HTTP_CLIENT = None
+
+
+def _replace_file(src: str, dst: str) -> None:
+    """dstをsrcの内容でアトミックに置き換える（読みかけのプロセスに壊れたファイルを見せない）"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dst), suffix='.tmp')
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def startup_cookies() -> None:
+    """アプリ起動時にリポジトリのcookiesを実行時用のパスへコピー"""
+    # cookiesがなくてもワーカーが更新分を書き込めるようディレクトリは用意する
+    os.makedirs(os.path.dirname(COOKIES_PATH), exist_ok=True)
+    if not os.path.exists(COOKIES_SOURCE_PATH):
+        return
+    # 先に起動した別のuvicornワーカーが更新したコピーは上書きしない
+    if os.path.exists(COOKIES_PATH) and os.path.getmtime(COOKIES_PATH) >= os.path.getmtime(COOKIES_SOURCE_PATH):
+        return
+    try:
+        _replace_file(COOKIES_SOURCE_PATH, COOKIES_PATH)
+    except OSError as e:
+        logger.error(f"Error copying cookies to {COOKIES_PATH}: {str(e)}")
+
+
+def shutdown_cookies() -> None:
+    """アプリ終了時に、ワーカーが更新したcookiesをリポジトリのファイルへ1回だけ書き戻す"""
+    if not os.path.exists(COOKIES_PATH):
+        return
+    try:
+        _replace_file(COOKIES_PATH, COOKIES_SOURCE_PATH)
+    except OSError as e:
+        logger.error(f"Error writing cookies back to {COOKIES_SOURCE_PATH}: {str(e)}")
+
+
+# watch?v= / youtu.be / shorts / embed / v の各形式から11文字の動画IDを1回の走査で抽出
+# （埋め込みプレイリストの /embed/videoseries は動画IDではない）
+_YT_EXTRACT_RE = re.compile(
+    r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/(?!videoseries(?![A-Za-z0-9_-]))|/v/)'
+    r'([A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])'
+)
+_PLAYLIST_ID_RE = re.compile(r'[A-Za-z0-9_-]+')
+# 受け付けるYouTubeのホスト（サブドメインを含む）
+_YT_HOSTS = ('youtube.com', 'youtube-nocookie.com', 'youtu.be')
+
+
+def _is_youtube_host(hostname: Optional[str]) -> bool:
+    """ホスト名がYouTubeのドメインかを判定"""
+    return bool(hostname) and any(hostname == host or hostname.endswith(f".{host}") for host in _YT_HOSTS)
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_youtube_url(url: str) -> Tuple[Optional[str], Optional[str]]:
+    """URLを(動画ID, プレイリストID)に分解（URLごとにメモ化、YouTube以外のホストは(None, None)）"""
+    parsed = urllib.parse.urlparse(url)
+    if not _is_youtube_host(parsed.hostname):
+        return None, None
+
+    match = _YT_EXTRACT_RE.search(url)
+    video_id = match.group(1) if match else None
+
+    query_params = urllib.parse.parse_qs(parsed.query)
+    playlist_id = query_params.get('list', [None])[0]
+    # キャッシュのファイル名に使うので、YouTubeのID文字以外を含むものは無効とする
+    if playlist_id and not _PLAYLIST_ID_RE.fullmatch(playlist_id):
+        playlist_id = None
+    return video_id, playlist_id
+
+
+def _jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """JPEGのSOFマーカーから(幅, 高さ)を読む（デコードしない）"""
+    if data[:2] != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # パディング
+            i += 1
+            continue
+        # SOF0〜SOF15（DHT/JPG/DACを除く）
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height
+        segment_length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        i += 2 + segment_length
+    return None
+
+
+# キャッシュに残す動画情報のキー（formatsや字幕一覧など大きな項目は捨てる）
+_VIDEO_INFO_KEYS = (
+    'id', 'title', 'uploader', 'upload_date', 'duration', 'album', '_type',
+    'thumbnail', 'url', 'http_headers', 'cookies', 'format_id',
+)
+
+
+def _trim_video_info(info: Dict) -> Dict:
+    """動画情報を抽出・タグ付けで使う項目だけに絞る"""
+    trimmed = {key: info[key] for key in _VIDEO_INFO_KEYS if key in info}
+    # サムネイル候補は先頭のURLしか使わない
+    thumbnail_url = next((t['url'] for t in info.get('thumbnails') or [] if t.get('url')), None)
+    if thumbnail_url:
+        trimmed['thumbnails'] = [{'url': thumbnail_url}]
+    return trimmed
+
+
+def _cookie_header(cookies: Optional[str]) -> str:
+    """yt-dlpのcookies（Set-Cookie形式の文字列）からCookieヘッダーの値を作る"""
+    if not cookies:
+        return ''
+    return '; '.join(f"{morsel.key}={morsel.value}" for morsel in LenientSimpleCookie(cookies).values())
+
+
+def _trim_playlist_info(info: Dict) -> Dict:
+    """プレイリスト情報をタイトル・IDと各動画のIDだけに絞る"""
+    return {
+        '_type': info.get('_type'),
+        'id': info.get('id'),
+        'title': info.get('title'),
+        'entries': [{'id': entry.get('id')} for entry in info.get('entries') or [] if entry],
+    }
+
+
+# メタデータキャッシュ（リクエスト間で共有）
+_metadata_cache = MetadataCache(os.path.join(TEMP_DIR, ".meta"))
+
 class AudioExtractor:
 
     def __init__(self):
-        self.temp_dir = "temp"
+        self.temp_dir = TEMP_DIR
         os.makedirs(self.temp_dir, exist_ok=True)
-        
-        # cookiesファイルパスの設定
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        self.cookies_path = os.path.join(current_dir, 'cookies.firefox-private.txt')
-        
-        # yt-dlpオプションの改善
-        self.ydl_opts = {
-            'format': 'bestaudio/best',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '320',
-            }],
-            'writethumbnail': True,
-            'outtmpl': f'{self.temp_dir}/%(id)s.%(ext)s',
-            'quiet': False,
-            'no_warnings': False,
-            'cookiefile': self.cookies_path,
-            'extract_flat': True,
-            'noplaylist': False,
-            # 以下の設定を追加
-            'sleep_interval': 5,  # リクエスト間の遅延を追加
-            'max_sleep_interval': 10,
-            'geo_bypass': True,
-            'geo_bypass_country': 'US',
-            # より一般的なユーザーエージェントに変更
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept-Language': 'en-US,en;q=0.9',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            }
-        }
-
-
-    # _get_video_infoメソッド内のvideo_optsの設定も修正
+        self.metadata_cache = _metadata_cache
 
 
     async def _get_video_info(self, url: str) -> Dict:
@@ -59,67 +280,36 @@ class AudioExtractor:
         try:
             # まず正しい動画IDを取得
             video_id = self._extract_video_id(url)
-            logger.info(f"Extracted video ID from URL: {video_id}")
-
-            # プレイリスト情報用の設定
-            playlist_opts = {
-                **self.ydl_opts,
-                'extract_flat': True,
-                'noplaylist': False,
-            }
-
-            # 単一動画情報用の設定
-            video_opts = {
-                **self.ydl_opts,
-                'extract_flat': False,
-                'noplaylist': True,
-                'verbose': True  # より詳細なログを有効化
-            }
-            # cookiesfileの指定は既に初期化時に含まれているので不要
-            
 
-            with yt_dlp.YoutubeDL(playlist_opts) as ydl:
-                try:
-                    # プレイリスト情報の取得を試みる
-                    playlist_info = await asyncio.to_thread(ydl.extract_info, url, download=False)
-                    
-                    # プレイリスト情報の保存
+            try:
+                # プレイリスト情報と動画情報は独立しているので並行して取得
+                playlist_data, video_info = await asyncio.gather(
+                    self._extract_playlist_meta(url),
+                    self._extract_video_meta(video_id),
+                    return_exceptions=True
+                )
+
+                # 動画情報の失敗のみ致命的とし、プレイリスト情報の失敗は無視
+                if isinstance(video_info, BaseException):
+                    raise video_info
+                if isinstance(playlist_data, BaseException):
+                    logger.warning(f"Could not get playlist info, continuing without it: {str(playlist_data)}")
                     playlist_data = None
-                    if playlist_info.get('_type') == 'playlist':
-                        playlist_data = {
-                            'playlist_title': playlist_info.get('title'),
-                            'playlist_id': playlist_info.get('id'),
-                        }
-                        logger.info(f"Found playlist info: {playlist_data}")
-                        logger.info("===================================")
-                        logger.info(playlist_info)
-                        
-                        logger.info("===================================")
-                        
-                        
-                    
-                    
-                    # 単一動画の情報を取得
-                    with yt_dlp.YoutubeDL(video_opts) as video_ydl:
-                        video_url = f"https://www.youtube.com/watch?v={video_id}"
-                        video_info = await asyncio.to_thread(video_ydl.extract_info, video_url, download=False)
-
-                        if not video_info or 'id' not in video_info:
-                            raise HTTPException(status_code=400, detail="Video not found")
 
-                        # プレイリスト情報があれば追加
-                        if playlist_data:
-                            video_info.update(playlist_data)
+                # プレイリスト情報があれば追加（キャッシュ本体は変更しない）
+                video_info = dict(video_info)
+                if playlist_data:
+                    video_info.update(playlist_data)
 
-                        logger.info(f"Successfully retrieved video info - Title: {video_info.get('title')}, ID: {video_info.get('id')}")
-                        return video_info
+                logger.info(f"Successfully retrieved video info - Title: {video_info.get('title')}, ID: {video_info.get('id')}")
+                return video_info
 
-                except yt_dlp.utils.ExtractorError as e:
-                    logger.error(f"Extractor error: {str(e)}")
-                    raise HTTPException(status_code=400, detail=f"Could not extract video info: {str(e)}")
-                except yt_dlp.utils.DownloadError as e:
-                    logger.error(f"Download error: {str(e)}")
-                    raise HTTPException(status_code=400, detail=f"Video not available: {str(e)}")
+            except yt_dlp.utils.ExtractorError as e:
+                logger.error(f"Extractor error: {str(e)}")
+                raise HTTPException(status_code=400, detail=f"Could not extract video info: {str(e)}")
+            except yt_dlp.utils.DownloadError as e:
+                logger.error(f"Download error: {str(e)}")
+                raise HTTPException(status_code=400, detail=f"Video not available: {str(e)}")
 
         except HTTPException:
             raise
@@ -127,53 +317,105 @@ class AudioExtractor:
             logger.error(f"Unexpected error: {str(e)}")
             raise HTTPException(status_code=400, detail="Could not process video URL")
 
-    def center_crop_square(self, img: Image.Image) -> Image.Image:
-        """画像を中央から正方形にクロップ"""
+    async def _extract_video_meta(self, video_id: str) -> Dict:
+        """単一動画の情報を取得（キャッシュがあれば再利用）"""
+        video_info = self.metadata_cache.get(video_id)
+        if video_info is None:
+            video_url = f"https://www.youtube.com/watch?v={video_id}"
+            video_info = await ydl_pool.extract_info('video', VIDEO_OPTS, video_url)
+
+            if not video_info or 'id' not in video_info:
+                raise HTTPException(status_code=400, detail="Video not found")
+
+            video_info = _trim_video_info(video_info)
+            self.metadata_cache.set(video_id, video_info)
+        return video_info
+
+    async def _extract_playlist_meta(self, url: str) -> Optional[Dict]:
+        """プレイリストのタイトルとIDを取得（listパラメータがない場合はNone）"""
+        playlist_id = self._extract_playlist_id(url)
+        if not playlist_id:
+            return None
+
+        meta_key = f"{playlist_id}.meta"
+        playlist_data = self.metadata_cache.get(meta_key)
+        if playlist_data is None:
+            # get_playlist_infoで取得済みの全体情報があればそれを使う
+            playlist_info = self.metadata_cache.get(playlist_id)
+            if playlist_info is None:
+                playlist_info = await ydl_pool.extract_info('playlist_meta', PLAYLIST_META_OPTS, url)
+
+            playlist_data = {}
+            if playlist_info.get('_type') == 'playlist':
+                playlist_data = {
+                    'playlist_title': playlist_info.get('title'),
+                    'playlist_id': playlist_info.get('id'),
+                }
+            self.metadata_cache.set(meta_key, playlist_data)
+
+        if playlist_data:
+            logger.info(f"Found playlist info: {playlist_data}")
+        return playlist_data or None
+
+    def center_crop_square(self, img: Image.Image, max_size: Optional[int] = None) -> Image.Image:
+        """画像を中央から正方形にクロップ（max_sizeを超える場合は同時に縮小）"""
         width, height = img.size
-        if width == height:
+        new_size = min(width, height)
+        if width == height and (not max_size or new_size <= max_size):
             return img
         
-        new_size = min(width, height)
         # 中央を基準にクロップする位置を計算
         left = (width - new_size) // 2
         top = (height - new_size) // 2
         right = left + new_size
         bottom = top + new_size
         
+        # 縮小が必要ならクロップと縮小を1回のリサンプルで行う
+        if max_size and new_size > max_size:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Cropping and resizing image from {width}x{height} to {max_size}x{max_size}")
+            return img.resize((max_size, max_size), Image.Resampling.BICUBIC, box=(left, top, right, bottom))
+
         # クロップを実行
-        logger.info(f"Cropping image from {width}x{height} to {new_size}x{new_size}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Cropping image from {width}x{height} to {new_size}x{new_size}")
         return img.crop((left, top, right, bottom))
         
         
     async def cleanup_old_files(self, keep_latest: int = 5):
-        """最新のN個以外の一時ファイルを削除"""
+        """最新のN個以外の一時ファイルを削除（イベントループを塞がないようスレッドで実行）"""
+        return await asyncio.to_thread(self._cleanup_sync, keep_latest)
+
+    def _cleanup_sync(self, keep_latest: int) -> int:
+        """cleanup_old_filesの同期処理本体"""
+        # 期限切れのメタデータキャッシュもあわせて削除
+        self.metadata_cache.prune()
         try:
-            files = []
-            for f in os.listdir(self.temp_dir):
-                path = os.path.join(self.temp_dir, f)
-                if os.path.isfile(path):
-                    files.append((path, os.path.getmtime(path)))
+            # scandirのDirEntryはis_file/statの結果をキャッシュする
+            with os.scandir(self.temp_dir) as it:
+                files = [(e.path, e.stat().st_mtime) for e in it if e.is_file()]
             
-            # 更新時刻で並べ替え
-            files.sort(key=lambda x: x[1], reverse=True)
+            # 最新N件のみ選び出し（全体のソートは不要）
+            keep = {path for path, _ in heapq.nlargest(keep_latest, files, key=lambda x: x[1])}
+            old_files = [path for path, _ in files if path not in keep]
             
             # 古いファイルを削除
-            for file_path, _ in files[keep_latest:]:
+            for file_path in old_files:
                 try:
                     os.remove(file_path)
                     logger.info(f"Cleaned up old file: {file_path}")
                 except Exception as e:
                     logger.error(f"Error deleting file {file_path}: {e}")
                     
-            return len(files[keep_latest:])  # 削除したファイル数を返す
+            return len(old_files)  # 削除したファイル数を返す
         except Exception as e:
             logger.error(f"Error during cleanup: {e}")
             return 0
 
 
 
-    async def extract(self, url: str, output_dir: str = None) -> Dict:
-        """音声を抽出してタグを設定"""
+    async def extract(self, url: str, output_dir: str = None, if_none_match: Optional[str] = None) -> Dict:
+        """音声を抽出してタグを設定（if_none_matchがETagと一致すれば変換せずに返す）"""
         retry_count = 3  # リトライ回数を設定
         retry_delay = 2  # リトライ間の待機時間（秒）
 
@@ -183,54 +425,52 @@ class AudioExtractor:
                 if not info:
                     raise HTTPException(status_code=400, detail="Could not get video information")
 
-                # 保存先ディレクトリを設定
-                original_temp_dir = self.temp_dir
+                # クライアントが同じ音声を保持していれば変換しない
+                etag = self._audio_etag(info, self._extract_playlist_id(url))
+                if if_none_match == etag:
+                    return {"video_id": info['id'], "etag": etag, "not_modified": True}
+
+                # 保存先ディレクトリを設定（共有インスタンスなのでself.temp_dirは書き換えない）
                 if output_dir:
-                    self.temp_dir = output_dir
                     logger.info(f"Using custom output directory: {output_dir}")
 
+                # 動画IDが分かった時点でサムネイル取得を開始し、変換と並行させる
+                thumbnail_task = asyncio.create_task(self._prepare_thumbnail(info))
                 try:
-                    output_file = await self._download_and_convert(url, info['id'])
-                    
-                    # ファイルの存在確認
-                    if not os.path.exists(output_file):
-                        raise Exception(f"File was not saved properly: {output_file}")
-                    
-                    # ファイルサイズの確認
-                    file_size = os.path.getsize(output_file)
-                    if file_size == 0:
-                        raise Exception(f"File is empty: {output_file}")
+                    output_file = await self._download_and_convert(info, output_dir)
+                except Exception:
+                    thumbnail_task.cancel()
+                    # 署名付きストリームURLの期限切れなどに備え、再試行では情報を取り直す
+                    self.metadata_cache.delete(info['id'])
+                    raise
 
-                    await self._set_media_tags(output_file, info)
-                    safe_title = "".join(c for c in info['title'] if c.isalnum() or c in (' ', '-', '_')).rstrip()
-                    
-                    # MP3ファイルとして正しく保存されているか確認
-                    try:
-                        audio = ID3(output_file)
-                        logger.info(f"Successfully verified MP3 file: {safe_title}")
-                    except Exception as e:
-                        raise Exception(f"Invalid MP3 file: {str(e)}")
-
-                    result = {
-                        "video_id": info['id'],
-                        "title": info['title'],
-                        "duration": info.get('duration'),
-                        "file_path": output_file,
-                        "filename": f"{safe_title}.mp3"
-                    }
-
-                    # プレイリスト処理時はクリーンアップしない
-                    if not output_dir:
-                        cleaned = await self.cleanup_old_files(keep_latest=5)
-                        if cleaned > 0:
-                            logger.info(f"Cleaned up {cleaned} old files")
-
-                    return result
-
-                finally:
-                    # 元のtemp_dirを復元
-                    if output_dir:
-                        self.temp_dir = original_temp_dir
+                try:
+                    image_data = await thumbnail_task
+
+                    # ファイルサイズの確認（ヘッダーだけの壊れたファイルを除外）
+                    if os.path.getsize(output_file) <= 1024:
+                        raise Exception(f"File is too small: {output_file}")
+
+                    # アートワークの書き込みはファイルI/Oなのでスレッドで実行
+                    await asyncio.to_thread(self._write_tags, output_file, image_data)
+                except Exception:
+                    # 出力ファイル名は試行ごとに異なるので、失敗した分はここで削除する
+                    if os.path.exists(output_file):
+                        os.remove(output_file)
+                    raise
+
+                safe_title = safe_filename(info['title'])
+
+                result = {
+                    "video_id": info['id'],
+                    "title": info['title'],
+                    "duration": info.get('duration'),
+                    "file_path": output_file,
+                    "filename": f"{safe_title}.mp3",
+                    "etag": etag
+                }
+
+                return result
 
             except Exception as e:
                 logger.error(f"Attempt {attempt + 1}/{retry_count} failed: {str(e)}")
@@ -244,179 +484,207 @@ class AudioExtractor:
 
 
 
-    async def _set_media_tags(self, file_path: str, info: Dict) -> None:
-        """メディアタグを設定"""
+    async def _fetch_image(self, url: str) -> Optional[Tuple[bytes, Optional[str]]]:
+        """画像を(本文, ETag)で取得（ETagがあれば条件付きGET、取得できない・小さすぎる場合はNone）"""
+        cached = _THUMBNAIL_CACHE.get(url)
+        headers = {"If-None-Match": cached[0]} if cached else {}
         try:
-            # メタデータの設定
-            try:
-                audio = EasyID3(file_path)
-            except error:
-                audio = ID3()
-                audio.save(file_path)
-                audio = EasyID3(file_path)
-
-            # 基本的なメタデータを設定
-            title = info.get('title', '')
-            artist = info.get('uploader', '')
-            album = info.get('playlist_title', '') or info.get('album', 'YouTube Music')
-
-            audio['title'] = title
-            audio['artist'] = artist
-            audio['album'] = album
-            if info.get('upload_date'):
-                audio['date'] = info['upload_date'][:4]
-            audio.save()
-
-            # 画像の設定
+            async with _get_http_client().stream('GET', url, headers=headers) as response:
+                if response.status_code == 304 and cached:
+                    logger.info(f"Thumbnail not modified: {url}")
+                    return cached[1], cached[0]
+                if response.status_code != 200:
+                    return None
+                # 本文を読む前にContent-Lengthでプレースホルダー画像を除外
+                content_length = response.headers.get("Content-Length")
+                if content_length is not None and int(content_length) <= MIN_THUMBNAIL_BYTES:
+                    logger.info(f"Skipping placeholder thumbnail ({content_length} bytes): {url}")
+                    return None
+                content = await response.aread()
+            if len(content) <= MIN_THUMBNAIL_BYTES:
+                return None
+            return content, response.headers.get("ETag")
+        except Exception as e:
+            logger.error(f"Error fetching image {url}: {str(e)}")
+            return None
+
+    async def _prepare_thumbnail(self, info: Dict) -> Optional[bytes]:
+        """サムネイルを取得して正方形のJPEGに変換"""
+        cover = _COVER_CACHE.get(info['id'])
+        if cover is not None:
+            logger.info(f"Cover cache hit: {info['id']}")
+            return cover
+
+        try:
+            # 画像の候補（優先順、重複なし）
             thumbnails = [
                 info.get('thumbnail'),
                 next((t['url'] for t in info.get('thumbnails', []) if t.get('url')), None),
                 f"https://i.ytimg.com/vi/{info['id']}/maxresdefault.jpg",
                 f"https://i.ytimg.com/vi/{info['id']}/hqdefault.jpg"
             ]
-            
-            thumbnail_url = next((url for url in thumbnails if url), None)
-            logger.info(f"Selected thumbnail URL: {thumbnail_url}")
-
-            if thumbnail_url:
-                response = requests.get(thumbnail_url)
-                if response.status_code == 200:
-                    # 画像をPILで開く
-                    img = Image.open(io.BytesIO(response.content))
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    
-                    # 画像を正方形にクロップ
-                    img = self.center_crop_square(img)
-                    
-                    # JPEG形式で保存
-                    output = io.BytesIO()
-                    img.save(output, format='JPEG', quality=95)
-                    image_data = output.getvalue()
-                    
-                    # ID3タグに画像を追加
-                    audio = ID3(file_path)
-                    audio.delall('APIC')  # 既存の画像を削除
-                    
-                    audio.add(APIC(
-                        encoding=3,
-                        mime='image/jpeg',
-                        type=3,
-                        desc='Cover',
-                        data=image_data
-                    ))
-                    audio.save(v2_version=3)
-                    
-                    # 検証
-                    verify_audio = ID3(file_path)
-                    apic_frames = verify_audio.getall('APIC')
-                    logger.info(f"Embedded image size: {len(image_data)} bytes")
-                    logger.info(f"Number of APIC frames: {len(apic_frames)}")
-                    logger.info(f"Set metadata - Title: {title}, Artist: {artist}, Album: {album}")
+            candidates = list(dict.fromkeys(url for url in thumbnails if url))
+
+            # 優先順に1件ずつ取得し、最初に使えた画像を採用（残りの候補には問い合わせない）
+            fetched = None
+            for url in candidates:
+                fetched = await self._fetch_image(url)
+                if fetched:
+                    logger.info(f"Selected thumbnail URL: {url}")
+                    break
+
+            if not fetched:
+                return None
+
+            # 採用した候補だけをETag付きで保存
+            content, etag = fetched
+            if etag:
+                _THUMBNAIL_CACHE[url] = (etag, content)
+
+            # PILの処理はCPU処理なのでスレッドで実行
+            cover = await asyncio.to_thread(self._encode_cover, content)
+            _COVER_CACHE[info['id']] = cover
+            return cover
+
+        except Exception as e:
+            logger.error(f"Error preparing thumbnail: {str(e)}")
+            return None
+
+    def _encode_cover(self, content: bytes) -> bytes:
+        """画像を正方形にクロップしてJPEGに変換"""
+        # 既に最大辺以下の正方形JPEGならデコードせずそのまま使う
+        size = _jpeg_size(content)
+        if size and size[0] == size[1] <= COVER_MAX_SIZE:
+            return content
+
+        # 画像をPILで開く（JPEGはlibjpegのDCTスケーリングで縮小デコード）
+        img = Image.open(io.BytesIO(content))
+        img.draft('RGB', (COVER_MAX_SIZE, COVER_MAX_SIZE))
+        # RGB/グレースケールはJPEGにそのまま保存できるので変換しない
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        
+        # 画像を正方形にクロップ
+        img = self.center_crop_square(img, max_size=COVER_MAX_SIZE)
+        
+        # JPEG形式で保存
+        output = io.BytesIO()
+        img.save(output, format='JPEG', quality=85, optimize=True, progressive=True, subsampling=2)
+        return output.getvalue()
+
+    def _audio_etag(self, info: Dict, playlist_id: Optional[str]) -> str:
+        """音声ファイルの中身を決める要素（動画・プレイリスト・タグ・アートワーク・変換設定）からETagを生成"""
+        key = json.dumps([
+            info['id'],
+            playlist_id,
+            self._metadata_args(info),
+            info.get('thumbnail'),
+            FFMPEG_OUTPUT_ARGS,
+        ], ensure_ascii=False)
+        return f'"{hashlib.blake2b(key.encode(), digest_size=8).hexdigest()}"'
+
+    def _metadata_args(self, info: Dict) -> Tuple[str, ...]:
+        """FFmpegの変換時に書き込むテキストタグの引数を生成"""
+        metadata = {
+            'title': info.get('title', ''),
+            'artist': info.get('uploader', ''),
+            'album': info.get('playlist_title', '') or info.get('album', 'YouTube Music'),
+        }
+        if info.get('upload_date'):
+            metadata['date'] = info['upload_date'][:4]
+        return tuple(arg for key, value in metadata.items() for arg in ('-metadata', f"{key}={value}"))
+
+    def _write_tags(self, file_path: str, image_data: Optional[bytes] = None) -> None:
+        """FFmpegが書いたID3タグにアートワークを追加"""
+        # テキストタグは変換時に書き込み済みなので、画像がなければファイルに触れない
+        if not image_data:
+            return
+        try:
+            try:
+                tags = ID3(file_path)
+            except ID3NoHeaderError:
+                tags = ID3()
+
+            # ID3タグに画像を追加
+            tags.add(APIC(
+                encoding=3,
+                mime='image/jpeg',
+                type=3,
+                desc='Cover',
+                data=image_data
+            ))
+            tags.save(file_path, v2_version=3)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Embedded image size: {len(image_data)} bytes")
 
         except Exception as e:
             logger.error(f"Error setting media tags: {str(e)}")
             import traceback
             logger.error(traceback.format_exc())
                         
-    # _download_and_convertメソッドを修正
-    async def _download_and_convert(self, url: str, video_id: str) -> str:
+    async def _download_and_convert(self, info: Dict, output_dir: Optional[str] = None) -> str:
+        """yt-dlpが解決したストリームURLをFFmpegで直接MP3に変換"""
         try:
-            # cookiesファイルの設定
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            cookies_path = os.path.join(current_dir, 'cookies.firefox-private.txt')
-            
-            # 出力ディレクトリの設定と確認
-            os.makedirs(self.temp_dir, exist_ok=True)
-            
-            # フォーマットを明示的に指定してダウンロード
-            current_opts = {
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '320',
-                }],
-                'writethumbnail': True,
-                'outtmpl': os.path.join(self.temp_dir, '%(id)s.%(ext)s'),
-                'cookiefile': cookies_path,
-                'noplaylist': True,  # プレイリストを無視
-                'sleep_interval': 5,
-                'geo_bypass': True,
-                'geo_bypass_country': 'US',
-                'http_headers': {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                    'Accept-Language': 'en-US,en;q=0.9',
-                },
-                'verbose': True,
-                # 直接ダウンロードURLのみ取得するオプション
-                'skip_download': False,
-                'progress': True
-            }
-            
-            logger.info(f"直接ダウンロード試行: {url} → {self.temp_dir}/{video_id}")
-            
-            # まず動画自体をダウンロード（mp3変換せず）
-            download_opts = current_opts.copy()
-            download_opts['postprocessors'] = []  # 後処理を無効化
-            
-            with yt_dlp.YoutubeDL(download_opts) as ydl:
-                # まず動画をダウンロード
-                await asyncio.to_thread(ydl.download, [url])
-                
-                # ダウンロードした動画ファイルを探す
-                video_files = [f for f in os.listdir(self.temp_dir) 
-                            if f.startswith(video_id) and not f.endswith('.webp')]
-                
-                if not video_files:
-                    logger.error(f"動画ファイルが見つかりません: {self.temp_dir}内のファイル: {os.listdir(self.temp_dir)}")
-                    raise Exception("ダウンロードに失敗しました")
-                
-                # 最初の動画ファイルを取得
-                video_file = os.path.join(self.temp_dir, video_files[0])
-                logger.info(f"ダウンロードした動画ファイル: {video_file}")
-                
-                # FFmpegで直接変換
-                output_file = os.path.join(self.temp_dir, f"{video_id}.mp3")
-                ffmpeg_cmd = [
-                    'ffmpeg', '-i', video_file, 
-                    '-vn', '-ar', '44100', '-ac', '2', '-b:a', '320k',
-                    output_file
-                ]
-                
-                logger.info(f"FFmpeg変換コマンド: {' '.join(ffmpeg_cmd)}")
-                
-                try:
-                    process = await asyncio.create_subprocess_exec(
-                        *ffmpeg_cmd,
-                        stdout=asyncio.subprocess.PIPE,
-                        stderr=asyncio.subprocess.PIPE
-                    )
-                    stdout, stderr = await process.communicate()
-                    
-                    if process.returncode != 0:
-                        logger.error(f"FFmpeg変換エラー: {stderr.decode()}")
-                        raise Exception(f"FFmpeg変換失敗: {stderr.decode()}")
-                    
-                    logger.info(f"FFmpeg変換成功: {output_file}")
-                    
-                    # 元の動画ファイルを削除
-                    os.remove(video_file)
-                except Exception as e:
-                    logger.error(f"FFmpeg実行エラー: {str(e)}")
-                    raise
-                
-                # 変換後のファイルを確認
-                if not os.path.exists(output_file):
-                    logger.error(f"MP3ファイルが見つかりません: {output_file}")
-                    raise Exception("MP3変換に失敗しました")
-                
-                file_size = os.path.getsize(output_file)
-                if file_size == 0:
-                    raise Exception(f"空のMP3ファイル: {output_file}")
-                    
-                logger.info(f"MP3変換成功: {output_file} ({file_size} bytes)")
-                return output_file
+            video_id = info['id']
+            output_dir = output_dir or self.temp_dir
+            os.makedirs(output_dir, exist_ok=True)
+
+            # 中間ファイルを作らず、選択済みフォーマットのURLをFFmpegに直接渡す
+            stream_url = info.get('url')
+            if not stream_url:
+                raise Exception(f"ストリームURLが取得できません: {video_id}")
+
+            headers = ''.join(f"{k}: {v}\r\n" for k, v in (info.get('http_headers') or {}).items())
+            # ストリームURLがcookies必須の場合に備え、yt-dlpが解決したcookiesも渡す
+            cookie_header = _cookie_header(info.get('cookies'))
+            if cookie_header:
+                headers += f"Cookie: {cookie_header}\r\n"
+            # 同じ動画の同時リクエストで上書き・削除し合わないよう呼び出しごとに一意の名前にする
+            output_file = os.path.join(output_dir, f"{video_id}-{uuid.uuid4().hex[:8]}.mp3")
+            ffmpeg_cmd = (
+                *FFMPEG_INPUT_ARGS,
+                '-headers', headers,
+                '-i', stream_url,
+                *FFMPEG_OUTPUT_ARGS,
+                *self._metadata_args(info),
+                output_file
+            )
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"直接ストリーム変換: {video_id} ({info.get('format_id')}) → {output_file}")
+
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *ffmpeg_cmd,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                _, stderr = await process.communicate()
+
+                if process.returncode != 0:
+                    if os.path.exists(output_file):
+                        os.remove(output_file)
+                    logger.error(f"FFmpeg変換エラー: {stderr.decode()}")
+                    raise Exception(f"FFmpeg変換失敗: {stderr.decode()}")
+
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"FFmpeg変換成功: {output_file}")
+            except Exception as e:
+                logger.error(f"FFmpeg実行エラー: {str(e)}")
+                raise
+
+            # 変換後のファイルを確認
+            if not os.path.exists(output_file):
+                logger.error(f"MP3ファイルが見つかりません: {output_file}")
+                raise Exception("MP3変換に失敗しました")
+
+            file_size = os.path.getsize(output_file)
+            if file_size == 0:
+                raise Exception(f"空のMP3ファイル: {output_file}")
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"MP3変換成功: {output_file} ({file_size} bytes)")
+            return output_file
 
         except Exception as e:
             logger.error(f"変換処理エラー: {str(e)}")
@@ -431,71 +699,67 @@ class AudioExtractor:
                 
     def _extract_video_id(self, url: str) -> str:
         """URLから動画IDを抽出"""
-        import urllib.parse
-
-        # URLをパース
-        parsed_url = urllib.parse.urlparse(url)
-        query_params = urllib.parse.parse_qs(parsed_url.query)
-        
-        # 'v' パラメータから動画IDを取得
-        video_id = query_params.get('v', [None])[0]
-        
+        video_id, _ = _parse_youtube_url(url)
         if not video_id:
-            # youtu.be形式の場合
-            if 'youtu.be' in url:
-                video_id = parsed_url.path.strip('/')
-        
-        if not video_id or len(video_id) != 11:
             logger.error(f"Invalid video ID extracted from URL: {url}")
             raise HTTPException(status_code=400, detail="Could not extract valid video ID")
         
-        logger.info(f"Extracted video ID: {video_id}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Extracted video ID: {video_id}")
         return video_id
 
 
-    def _is_valid_youtube_url(self, url: str) -> bool:
-        """YouTubeのURLが有効かチェック"""
-        import re
-        import urllib.parse
-        
-        try:
-            parsed_url = urllib.parse.urlparse(url)
-            query_params = urllib.parse.parse_qs(parsed_url.query)
-            
-            # 通常の動画ID
-            video_id = query_params.get('v', [None])[0]
-            if not video_id:
-                # youtu.be形式の確認
-                video_id = parsed_url.path.strip('/')
-            
-            # Radio/Mixリストの場合は特別な処理
-            if 'start_radio' in query_params:
-                logger.info("Detected Radio/Mix playlist")
-                # 最初の動画のみを処理
-                return bool(video_id and len(video_id) == 11)
-                
-            return bool(video_id and len(video_id) == 11)
-            
-        except Exception as e:
-            logger.error(f"Error parsing URL: {str(e)}")
-            return False
-        
-        
-        
-        
+    def _extract_playlist_id(self, url: str) -> Optional[str]:
+        """URLのlistパラメータからプレイリストIDを抽出"""
+        _, playlist_id = _parse_youtube_url(url)
+        return playlist_id
+
+
     async def get_playlist_info(self, url: str) -> Dict:
         """プレイリストの情報を取得"""
-        playlist_opts = {
-            **self.ydl_opts,
-            'extract_flat': True,  # プレイリスト情報のみを取得
-            'noplaylist': False    # プレイリストを許可
-        }
+        playlist_id = self._extract_playlist_id(url)
+        if playlist_id:
+            cached = self.metadata_cache.get(playlist_id)
+            if cached is not None:
+                return cached
 
         try:
-            with yt_dlp.YoutubeDL(playlist_opts) as ydl:
-                info = await asyncio.to_thread(ydl.extract_info, url, download=False)
-                logger.info(f"Retrieved playlist info with {len(info.get('entries', []))} videos")
-                return info
+            info = _trim_playlist_info(await ydl_pool.extract_info('playlist', PLAYLIST_OPTS, url))
+            logger.info(f"Retrieved playlist info with {len(info.get('entries', []))} videos")
+            if playlist_id:
+                self.metadata_cache.set(playlist_id, info)
+            return info
         except Exception as e:
             logger.error(f"Error getting playlist info: {str(e)}")
-            raise HTTPException(status_code=400, detail=f"Could not get playlist info: {str(e)}")
\ No newline at end of file
+            raise HTTPException(status_code=400, detail=f"Could not get playlist info: {str(e)}")
+
+    async def download_playlist(self, url: str, output_dir: str, concurrency: int = PLAYLIST_CONCURRENCY) -> List:
+        """プレイリストの全動画を並行して抽出（失敗した動画は例外として返す）"""
+        playlist_info = await self.get_playlist_info(url)
+        video_ids = [entry.get('id') for entry in playlist_info.get('entries', []) if entry.get('id')]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def extract_entry(video_id: str) -> Dict:
+            video_url = f"https://www.youtube.com/watch?v={video_id}"
+            async with semaphore:
+                try:
+                    return await self.extract(video_url, output_dir=output_dir)
+                except Exception as e:
+                    logger.error(f"Error processing video {video_id}: {str(e)}")
+                    raise
+
+        logger.info(f"Downloading {len(video_ids)} videos with concurrency {concurrency}")
+        return await asyncio.gather(*[extract_entry(video_id) for video_id in video_ids], return_exceptions=True)
+
+    def clear_cache(self) -> int:
+        """メタデータキャッシュを全削除"""
+        return self.metadata_cache.clear()
+
+
+# リクエスト間で共有するインスタンス
+_SHARED_EXTRACTOR = AudioExtractor()
+
+
+def get_extractor() -> AudioExtractor:
+    """FastAPIのDependsで注入する共有AudioExtractor"""
+    return _SHARED_EXTRACTOR
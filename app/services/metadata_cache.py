@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import re
+from typing import Dict, Optional
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# キーはファイル名になるので、ID文字と区切りのドットのみ許可（パス区切りや".."は不可）
+_KEY_RE = re.compile(r'[A-Za-z0-9_-]+(?:\.[A-Za-z0-9_-]+)*')
+
+
+class MetadataCache:
+    """yt-dlpのメタデータをメモリ(TTL)とディスク(JSON)の2段でキャッシュ"""
+
+    def __init__(self, cache_dir: str, maxsize: int = 2048, ttl: int = 3600):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def _path(self, key: str) -> str:
+        if not _KEY_RE.fullmatch(key):
+            raise ValueError(f"Invalid cache key: {key!r}")
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict]:
+        """キャッシュから取得（メモリ → ディスクの順）"""
+        info = self._memory.get(key)
+        if info is not None:
+            logger.info(f"Metadata cache hit (memory): {key}")
+            return info
+
+        try:
+            path = self._path(key)
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                # 期限切れのファイルは読まずに削除
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        self._memory[key] = info
+        logger.info(f"Metadata cache hit (disk): {key}")
+        return info
+
+    def set(self, key: str, info: Dict) -> None:
+        """キャッシュに保存（ディスクへはアトミックに書き込み）"""
+        try:
+            path = self._path(key)
+        except ValueError as e:
+            logger.error(f"Error writing metadata cache: {str(e)}")
+            return
+        self._memory[key] = info
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(info, f, ensure_ascii=False, default=str)
+                os.replace(tmp_path, path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+        except Exception as e:
+            logger.error(f"Error writing metadata cache {key}: {str(e)}")
+
+    def delete(self, key: str) -> None:
+        """キャッシュからエントリを削除（メモリとディスクの両方）"""
+        self._memory.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except (OSError, ValueError):
+            pass
+
+    def prune(self) -> int:
+        """期限切れのディスクエントリを削除し、削除した数を返す"""
+        removed = 0
+        expires = time.time() - self.ttl
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file() and entry.stat().st_mtime < expires:
+                            os.remove(entry.path)
+                            removed += 1
+                    except OSError as e:
+                        logger.error(f"Error deleting cache file {entry.name}: {e}")
+        except FileNotFoundError:
+            pass
+        if removed:
+            logger.info(f"Pruned {removed} expired metadata cache files")
+        return removed
+
+    def clear(self) -> int:
+        """全キャッシュを削除し、削除したディスクエントリ数を返す"""
+        self._memory.clear()
+        removed = 0
+        try:
+            for f in os.listdir(self.cache_dir):
+                try:
+                    os.remove(os.path.join(self.cache_dir, f))
+                    removed += 1
+                except OSError as e:
+                    logger.error(f"Error deleting cache file {f}: {e}")
+        except FileNotFoundError:
+            pass
+        logger.info(f"Cleared metadata cache ({removed} files)")
+        return removed
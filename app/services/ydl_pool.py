@@ -0,0 +1,117 @@
+import os
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+import yt_dlp
+
+logger = logging.getLogger(__name__)
+
+# yt-dlpの情報抽出を実行するワーカープロセス数（1プロセスあたり数十MBを使う）
+YDL_WORKERS = int(os.environ.get("YDL_WORKERS", "2"))
+
+# ワーカープロセス内で設定ごとに使い回すYoutubeDL
+_worker_ydls: Dict[str, yt_dlp.YoutubeDL] = {}
+
+# cookiesの書き戻しをワーカー間で直列化するロック（プール生成時に各ワーカーへ渡す）
+_cookie_lock = None
+
+
+def _init_worker(cookie_lock) -> None:
+    """ワーカープロセスの初期化"""
+    global _cookie_lock
+    _cookie_lock = cookie_lock
+
+
+def _save_cookies(ydl: yt_dlp.YoutubeDL) -> None:
+    """更新されたcookiesを実行時用のファイルに書き戻す（他のワーカーが読みかけないようアトミックに置き換え）"""
+    cookiefile = ydl.params.get('cookiefile')
+    if not cookiefile:
+        return
+    try:
+        with _cookie_lock or contextlib.nullcontext():
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cookiefile), suffix='.tmp')
+            os.close(fd)
+            try:
+                ydl.cookiejar.save(tmp_path)
+                os.replace(tmp_path, cookiefile)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+    except Exception as e:
+        logger.error(f"Error saving cookies to {cookiefile}: {str(e)}")
+
+
+def _extract_info_in_worker(profile: str, opts: Dict, url: str) -> Optional[Dict]:
+    """ワーカープロセス側でextract_infoを実行し、プロセス間で渡せる形に整える"""
+    ydl = _worker_ydls.get(profile)
+    if ydl is None:
+        # オプション解析・cookies読み込みが重いので、プロセスごとに1回だけ生成
+        ydl = _worker_ydls[profile] = yt_dlp.YoutubeDL(opts)
+    try:
+        info = ydl.extract_info(url, download=False)
+    except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError) as e:
+        # yt-dlpの例外はトレースバックを保持していてpickleできないのでメッセージだけを返す
+        raise yt_dlp.utils.DownloadError(str(e)) from None
+    except Exception:
+        # 想定外の例外は原因を追えるよう、ワーカー側のトレースバックをメッセージに含めて返す
+        raise RuntimeError(traceback.format_exc()) from None
+    finally:
+        # ログイン状態を保つため、YouTubeが更新したcookiesを実行時用のコピーに書き戻す
+        # （リポジトリのファイルへはアプリ終了時にshutdown_cookiesで1回だけ反映）
+        _save_cookies(ydl)
+    return yt_dlp.YoutubeDL.sanitize_info(info)
+
+
+# GILを共有しないよう、yt-dlpの抽出は別プロセスで並列実行する
+_POOL: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """共有プロセスプールを取得（未生成なら生成）"""
+    global _POOL
+    if _POOL is None:
+        # スレッドを持つプロセスからのforkを避けるためspawnで起動
+        mp_context = multiprocessing.get_context('spawn')
+        _POOL = ProcessPoolExecutor(
+            max_workers=YDL_WORKERS,
+            mp_context=mp_context,
+            initializer=_init_worker,
+            initargs=(mp_context.Lock(),)
+        )
+        logger.info(f"Started yt-dlp process pool with {YDL_WORKERS} workers")
+    return _POOL
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """壊れたプロセスプールを破棄（他のリクエストが作り直したプールは残す）"""
+    global _POOL
+    if _POOL is pool:
+        _POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def extract_info(profile: str, opts: Dict, url: str) -> Optional[Dict]:
+    """プロセスプールでyt-dlpの情報抽出を実行"""
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    try:
+        return await loop.run_in_executor(pool, _extract_info_in_worker, profile, opts, url)
+    except BrokenProcessPool:
+        # ワーカーが異常終了（OOMなど）するとプールは使えなくなるので、作り直して1回だけ再実行
+        logger.warning("yt-dlp worker process died, restarting the process pool")
+        _discard_pool(pool)
+        return await loop.run_in_executor(_get_pool(), _extract_info_in_worker, profile, opts, url)
+
+
+def shutdown_pool() -> None:
+    """アプリ終了時にプロセスプールを停止"""
+    global _POOL
+    if _POOL is not None:
+        _POOL.shutdown(cancel_futures=True)
+        _POOL = None
@@ -6,7 +6,9 @@ def test_health_check(client):
     """ヘルスチェックエンドポイントのテスト"""
     response = client.get("/health")
     assert response.status_code == 200
-    assert response.json() == {"status": "healthy"}
+    data = response.json()
+    assert data["status"] == "healthy"
+    assert data["yt_dlp_version"]
 
 def test_extract_audio_invalid_url_format(client):
     """不正なURL形式のテスト"""
@@ -32,4 +34,83 @@ def test_extract_audio_success(client, sample_youtube_url):
         json={"url": sample_youtube_url}
     )
     assert response.status_code == 200
-    assert response.headers["content-type"] == "audio/mpeg"
\ No newline at end of file
+    assert response.headers["content-type"] == "audio/mpeg"
+
+def test_extract_audio_precondition_failed(client, sample_youtube_url, monkeypatch):
+    """If-None-MatchがETagと一致すれば変換せず412を返す"""
+    from services.extractor import get_extractor
+    extractor = get_extractor()
+    info = {"id": "dQw4w9WgXcQ", "title": "Title", "uploader": "Artist", "thumbnail": "https://i.ytimg.com/a.jpg"}
+
+    async def fake_get_video_info(url):
+        return info
+
+    monkeypatch.setattr(extractor, "_get_video_info", fake_get_video_info)
+    response = client.post(
+        "/api/v1/extract-audio",
+        json={"url": sample_youtube_url},
+        headers={"If-None-Match": extractor._audio_etag(info, None)}
+    )
+    assert response.status_code == 412
+
+def test_extract_audio_precondition_retries_video_info(client, sample_youtube_url, monkeypatch):
+    """動画情報の取得が一度失敗しても再試行してからETagを比較する"""
+    from services.extractor import get_extractor
+    import services.extractor as extractor_module
+    extractor = get_extractor()
+    info = {"id": "dQw4w9WgXcQ", "title": "Title", "uploader": "Artist"}
+    calls = []
+
+    async def flaky_get_video_info(url):
+        calls.append(url)
+        if len(calls) == 1:
+            raise Exception("temporary failure")
+        return info
+
+    async def no_sleep(seconds):
+        pass
+
+    monkeypatch.setattr(extractor, "_get_video_info", flaky_get_video_info)
+    monkeypatch.setattr(extractor_module.asyncio, "sleep", no_sleep)
+    response = client.post(
+        "/api/v1/extract-audio",
+        json={"url": sample_youtube_url},
+        headers={"If-None-Match": extractor._audio_etag(info, None)}
+    )
+    assert response.status_code == 412
+    assert len(calls) == 2
+
+def test_audio_etag_depends_on_tags():
+    """プレイリストやタグが変わればETagも変わる"""
+    from services.extractor import get_extractor
+    extractor = get_extractor()
+    info = {"id": "dQw4w9WgXcQ", "title": "Title", "uploader": "Artist"}
+
+    etag = extractor._audio_etag(info, None)
+    assert etag == extractor._audio_etag(dict(info), None)
+    assert etag != extractor._audio_etag({**info, "playlist_title": "Album"}, "PLabc")
+    assert etag != extractor._audio_etag({**info, "title": "New Title"}, None)
+
+def test_clear_cache(client):
+    """メタデータキャッシュ削除エンドポイントのテスト"""
+    response = client.post("/api/v1/clear-cache")
+    assert response.status_code == 200
+    assert response.json()["status"] == "cleared"
+
+def test_build_album_zip(tmp_path):
+    """アルバムZIPが曲名のファイル名で作成されることのテスト"""
+    import zipfile
+    from mutagen.id3 import ID3, TIT2
+    from routes.audio import _build_album_zip
+
+    album_dir = tmp_path / "Album"
+    album_dir.mkdir()
+    file_path = album_dir / "dQw4w9WgXcQ-0000.mp3"
+    file_path.write_bytes(b"\x00" * 2048)
+    tags = ID3()
+    tags.add(TIT2(encoding=3, text="Song: Title"))
+    tags.save(str(file_path), v2_version=3)
+
+    zip_path = _build_album_zip(str(album_dir), "Album")
+    with zipfile.ZipFile(zip_path) as zipf:
+        assert zipf.namelist() == ["Album/Song Title.mp3"]
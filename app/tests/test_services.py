@@ -2,6 +2,7 @@ import pytest
 from services.extractor import AudioExtractor  # 相対インポートを絶対インポートに変更
 from fastapi import HTTPException
 import os
+import time
 
 
 @pytest.mark.asyncio
@@ -34,4 +35,438 @@ async def test_full_extraction_process(sample_youtube_url, temp_dir):
     
     # ファイルが実際に生成されているか確認
     assert os.path.exists(result['file_path'])
-    assert os.path.getsize(result['file_path']) > 0
\ No newline at end of file
+    assert os.path.getsize(result['file_path']) > 0
+
+def test_metadata_cache_roundtrip(temp_dir):
+    """メタデータキャッシュの保存・取得テスト"""
+    from services.metadata_cache import MetadataCache
+    cache = MetadataCache(temp_dir)
+    assert cache.get("dQw4w9WgXcQ") is None
+
+    cache.set("dQw4w9WgXcQ", {"id": "dQw4w9WgXcQ", "title": "test"})
+    assert cache.get("dQw4w9WgXcQ") == {"id": "dQw4w9WgXcQ", "title": "test"}
+
+    # ディスク層から復元できるか確認
+    reloaded = MetadataCache(temp_dir)
+    assert reloaded.get("dQw4w9WgXcQ")["title"] == "test"
+
+    reloaded.delete("dQw4w9WgXcQ")
+    assert reloaded.get("dQw4w9WgXcQ") is None
+    assert MetadataCache(temp_dir).get("dQw4w9WgXcQ") is None
+
+    cache.set("dQw4w9WgXcQ", {"id": "dQw4w9WgXcQ"})
+    assert cache.clear() == 1
+    assert cache.get("dQw4w9WgXcQ") is None
+
+
+def test_metadata_cache_rejects_path_keys(temp_dir):
+    """パス区切りを含むキーはディスクに書き込まない"""
+    from services.metadata_cache import MetadataCache
+    cache = MetadataCache(temp_dir)
+
+    cache.set("../pwned.meta", {})
+    assert cache.get("../pwned.meta") is None
+    assert not os.path.exists("pwned.meta.json")
+    assert os.listdir(temp_dir) == []
+
+
+def test_metadata_cache_prune(temp_dir):
+    """期限切れのディスクエントリを削除するテスト"""
+    from services.metadata_cache import MetadataCache
+    cache = MetadataCache(temp_dir, ttl=60)
+    cache.set("old", {"id": "old"})
+    cache.set("new", {"id": "new"})
+    expired = time.time() - 120
+    os.utime(os.path.join(temp_dir, "old.json"), (expired, expired))
+
+    assert cache.prune() == 1
+    assert os.listdir(temp_dir) == ["new.json"]
+
+
+def test_trim_video_info():
+    """キャッシュする動画情報から不要な大きい項目を除くテスト"""
+    from services.extractor import _trim_video_info
+    info = {
+        "id": "dQw4w9WgXcQ", "title": "Title", "url": "https://example.com/audio",
+        "cookies": "VISITOR_INFO1_LIVE=abc; Domain=.youtube.com; Path=/",
+        "formats": [{}] * 100, "automatic_captions": {"en": []},
+        "thumbnails": [{"id": "0"}, {"url": "https://i.ytimg.com/a.jpg"}, {"url": "https://i.ytimg.com/b.jpg"}],
+    }
+    assert _trim_video_info(info) == {
+        "id": "dQw4w9WgXcQ", "title": "Title", "url": "https://example.com/audio",
+        "cookies": "VISITOR_INFO1_LIVE=abc; Domain=.youtube.com; Path=/",
+        "thumbnails": [{"url": "https://i.ytimg.com/a.jpg"}],
+    }
+
+
+def test_cookie_header():
+    """yt-dlpのcookies文字列から属性を除いたCookieヘッダーを作るテスト"""
+    from services.extractor import _cookie_header
+    cookies = "a=1; Domain=.youtube.com; Path=/; Secure; Expires=1700000000; b=2; Domain=.youtube.com; Path=/"
+    assert _cookie_header(cookies) == "a=1; b=2"
+    assert _cookie_header(None) == ""
+
+
+def test_parse_youtube_url_rejects_invalid_playlist_id():
+    """ID文字以外を含むlistパラメータは無視する"""
+    extractor = AudioExtractor()
+    assert extractor._extract_playlist_id("https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLabc_-123") == "PLabc_-123"
+    assert extractor._extract_playlist_id("https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=../../../../tmp/pwned") is None
+
+
+def test_parse_youtube_url_requires_youtube_host():
+    """YouTube以外のホストのURLからはIDを取り出さない"""
+    from services.extractor import _parse_youtube_url
+    assert _parse_youtube_url("https://music.youtube.com/watch?v=dQw4w9WgXcQ&list=PL123") == ("dQw4w9WgXcQ", "PL123")
+    assert _parse_youtube_url("https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ") == ("dQw4w9WgXcQ", None)
+    assert _parse_youtube_url("https://example.com/watch?v=dQw4w9WgXcQ&list=PL123") == (None, None)
+    assert _parse_youtube_url("https://notyoutube.com/shorts/dQw4w9WgXcQ") == (None, None)
+    assert _parse_youtube_url("https://example.com/redirect?to=youtu.be/dQw4w9WgXcQ") == (None, None)
+
+
+def test_parse_youtube_url_skips_embed_videoseries():
+    """埋め込みプレイリストのURLでは videoseries を動画IDとして扱わない"""
+    from services.extractor import _parse_youtube_url
+    assert _parse_youtube_url("https://www.youtube.com/embed/videoseries?list=PL123") == (None, "PL123")
+    assert _parse_youtube_url("https://www.youtube.com/embed/dQw4w9WgXcQ?list=PL123") == ("dQw4w9WgXcQ", "PL123")
+
+
+def test_jpeg_size():
+    """JPEGヘッダーからのサイズ取得テスト"""
+    import io
+    from PIL import Image
+    from services.extractor import _jpeg_size
+
+    output = io.BytesIO()
+    Image.new('RGB', (320, 180)).save(output, format='JPEG')
+    assert _jpeg_size(output.getvalue()) == (320, 180)
+
+    output = io.BytesIO()
+    Image.new('RGB', (8, 8)).save(output, format='PNG')
+    assert _jpeg_size(output.getvalue()) is None
+
+
+def test_center_crop_square():
+    """画像の正方形クロップテスト"""
+    from PIL import Image
+    extractor = AudioExtractor()
+
+    assert extractor.center_crop_square(Image.new('RGB', (1280, 720))).size == (720, 720)
+    assert extractor.center_crop_square(Image.new('RGB', (1920, 1080)), max_size=720).size == (720, 720)
+
+
+def test_encode_cover():
+    """アートワークが最大辺以下の正方形JPEGになることのテスト"""
+    import io
+    from PIL import Image
+    from services.extractor import COVER_MAX_SIZE
+    extractor = AudioExtractor()
+
+    source = io.BytesIO()
+    Image.new('RGB', (1280, 720)).save(source, format='JPEG')
+    cover = Image.open(io.BytesIO(extractor._encode_cover(source.getvalue())))
+    assert cover.format == 'JPEG'
+    assert cover.size == (COVER_MAX_SIZE, COVER_MAX_SIZE)
+
+
+@pytest.mark.asyncio
+async def test_cleanup_old_files(temp_dir):
+    """古い一時ファイル削除のテスト"""
+    extractor = AudioExtractor()
+    extractor.temp_dir = temp_dir
+    for i in range(4):
+        path = os.path.join(temp_dir, f"{i}.mp3")
+        with open(path, "w") as f:
+            f.write("test")
+        os.utime(path, (1000 + i, 1000 + i))
+
+    assert await extractor.cleanup_old_files(keep_latest=2) == 2
+    assert sorted(os.listdir(temp_dir)) == ["2.mp3", "3.mp3"]
+
+
+def test_extract_video_id():
+    """URL形式ごとの動画ID抽出テスト"""
+    extractor = AudioExtractor()
+    assert extractor._extract_video_id("https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PL123") == "dQw4w9WgXcQ"
+    assert extractor._extract_video_id("https://youtu.be/dQw4w9WgXcQ") == "dQw4w9WgXcQ"
+    assert extractor._extract_video_id("https://www.youtube.com/shorts/dQw4w9WgXcQ") == "dQw4w9WgXcQ"
+    assert extractor._extract_playlist_id("https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PL123") == "PL123"
+
+    with pytest.raises(HTTPException):
+        extractor._extract_video_id("https://www.youtube.com/watch?v=!!!!!!!!!!!")
+
+
+def test_write_tags(temp_dir):
+    """変換時のタグを残したままアートワークを追加するテスト"""
+    from mutagen.id3 import ID3, TIT2
+    extractor = AudioExtractor()
+    file_path = os.path.join(temp_dir, "test.mp3")
+    with open(file_path, "wb") as f:
+        f.write(b"\x00" * 2048)
+
+    # FFmpegが書き込むテキストタグの代わり
+    tags = ID3()
+    tags.add(TIT2(encoding=3, text="Title"))
+    tags.save(file_path, v2_version=3)
+
+    extractor._write_tags(file_path, b"jpeg-bytes")
+
+    tags = ID3(file_path)
+    assert str(tags["TIT2"]) == "Title"
+    assert tags.getall("APIC")[0].data == b"jpeg-bytes"
+
+
+def test_metadata_args():
+    """FFmpegに渡すテキストタグ引数のテスト"""
+    extractor = AudioExtractor()
+    info = {"id": "dQw4w9WgXcQ", "title": "Title", "uploader": "Artist", "upload_date": "20091025"}
+
+    assert extractor._metadata_args(info) == (
+        "-metadata", "title=Title",
+        "-metadata", "artist=Artist",
+        "-metadata", "album=YouTube Music",
+        "-metadata", "date=2009",
+    )
+
+
+@pytest.mark.asyncio
+async def test_fetch_image_uses_etag():
+    """ETagがあれば条件付きGETを送り、304ならキャッシュを再利用。小さな画像は除外"""
+    import httpx
+    from services import extractor as extractor_module
+
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.headers.get("If-None-Match") == '"abc"':
+            return httpx.Response(304)
+        if request.url.path.endswith("/default.jpg"):
+            return httpx.Response(200, content=b"x" * 100)
+        return httpx.Response(200, content=b"jpeg" * 1024, headers={"ETag": '"abc"'})
+
+    url = "https://i.ytimg.com/vi/dQw4w9WgXcQ/hqdefault.jpg"
+    extractor_module._THUMBNAIL_CACHE.pop(url, None)
+    extractor_module._HTTP_CLIENT = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    try:
+        extractor = AudioExtractor()
+        assert await extractor._fetch_image(url) == (b"jpeg" * 1024, '"abc"')
+        # 取得しただけではキャッシュしない（採用された候補のみ_prepare_thumbnailで保存）
+        assert url not in extractor_module._THUMBNAIL_CACHE
+
+        extractor_module._THUMBNAIL_CACHE[url] = ('"abc"', b"cached" * 1024)
+        assert await extractor._fetch_image(url) == (b"cached" * 1024, '"abc"')
+        assert requests[1].headers["If-None-Match"] == '"abc"'
+        extractor_module._THUMBNAIL_CACHE.pop(url, None)
+        # 小さすぎる画像はプレースホルダーとして除外
+        assert await extractor._fetch_image("https://i.ytimg.com/vi/dQw4w9WgXcQ/default.jpg") is None
+    finally:
+        await extractor_module.shutdown_http_client()
+
+
+@pytest.mark.asyncio
+async def test_prepare_thumbnail_stops_at_first_usable_image(monkeypatch):
+    """サムネイル候補は優先順に取得し、使える画像が見つかったら残りは取得しない"""
+    extractor = AudioExtractor()
+    info = {"id": "aaaaaaaaaaa", "thumbnail": "https://i.ytimg.com/a.jpg"}
+    requested = []
+
+    async def fake_fetch_image(url):
+        requested.append(url)
+        return (b"image-bytes", None) if "maxresdefault" in url else None
+
+    monkeypatch.setattr(extractor, "_fetch_image", fake_fetch_image)
+    monkeypatch.setattr(extractor, "_encode_cover", lambda content: b"cover-bytes")
+    from services import extractor as extractor_module
+    try:
+        assert await extractor._prepare_thumbnail(info) == b"cover-bytes"
+    finally:
+        extractor_module._COVER_CACHE.pop("aaaaaaaaaaa", None)
+    assert requested == [
+        "https://i.ytimg.com/a.jpg",
+        "https://i.ytimg.com/vi/aaaaaaaaaaa/maxresdefault.jpg",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_prepare_thumbnail_uses_cover_cache():
+    """同じ動画のアートワークはキャッシュから返す"""
+    from services import extractor as extractor_module
+    extractor = AudioExtractor()
+
+    extractor_module._COVER_CACHE["dQw4w9WgXcQ"] = b"cover-bytes"
+    try:
+        assert await extractor._prepare_thumbnail({"id": "dQw4w9WgXcQ"}) == b"cover-bytes"
+    finally:
+        extractor_module._COVER_CACHE.pop("dQw4w9WgXcQ", None)
+
+
+@pytest.mark.asyncio
+async def test_extract_evicts_cached_info_on_download_failure(monkeypatch):
+    """変換に失敗したら再試行の前にキャッシュした動画情報を削除する"""
+    import asyncio
+    extractor = AudioExtractor()
+    info = {"id": "dQw4w9WgXcQ", "title": "Title", "url": "https://example.com/expired"}
+    evicted = []
+
+    async def fake_get_video_info(url):
+        return info
+
+    async def fake_download_and_convert(info, output_dir=None):
+        raise HTTPException(status_code=400, detail="403 Forbidden")
+
+    async def no_sleep(seconds):
+        pass
+
+    monkeypatch.setattr(extractor, "_get_video_info", fake_get_video_info)
+    monkeypatch.setattr(extractor, "_download_and_convert", fake_download_and_convert)
+    monkeypatch.setattr(extractor.metadata_cache, "delete", evicted.append)
+    monkeypatch.setattr(asyncio, "sleep", no_sleep)
+
+    with pytest.raises(HTTPException):
+        await extractor.extract("https://www.youtube.com/watch?v=dQw4w9WgXcQ")
+    assert evicted == ["dQw4w9WgXcQ"] * 3
+
+
+@pytest.mark.asyncio
+async def test_extract_removes_too_small_output(temp_dir, monkeypatch):
+    """変換結果が小さすぎる場合は出力ファイルを残さない"""
+    import asyncio
+    extractor = AudioExtractor()
+    info = {"id": "dQw4w9WgXcQ", "title": "Title"}
+
+    async def fake_get_video_info(url):
+        return info
+
+    async def fake_download_and_convert(info, output_dir=None):
+        output_file = os.path.join(output_dir, f"{info['id']}-{len(os.listdir(output_dir))}.mp3")
+        with open(output_file, "wb") as f:
+            f.write(b"\x00" * 16)
+        return output_file
+
+    async def fake_prepare_thumbnail(info):
+        return None
+
+    async def no_sleep(seconds):
+        pass
+
+    monkeypatch.setattr(extractor, "_get_video_info", fake_get_video_info)
+    monkeypatch.setattr(extractor, "_download_and_convert", fake_download_and_convert)
+    monkeypatch.setattr(extractor, "_prepare_thumbnail", fake_prepare_thumbnail)
+    monkeypatch.setattr(asyncio, "sleep", no_sleep)
+
+    with pytest.raises(HTTPException) as excinfo:
+        await extractor.extract("https://www.youtube.com/watch?v=dQw4w9WgXcQ", temp_dir)
+    assert "too small" in excinfo.value.detail
+    assert os.listdir(temp_dir) == []
+
+
+def test_ydl_worker_reraises_picklable_error():
+    """ワーカー内の例外はpickleできるDownloadErrorとして返す"""
+    import pickle
+    import yt_dlp
+    from services import ydl_pool
+
+    class FailingYoutubeDL:
+        params = {}
+
+        def extract_info(self, url, download=False):
+            try:
+                raise RuntimeError("boom")
+            except RuntimeError:
+                import sys
+                raise yt_dlp.utils.DownloadError("ERROR: boom", sys.exc_info())
+
+    ydl_pool._worker_ydls["failing"] = FailingYoutubeDL()
+    try:
+        with pytest.raises(yt_dlp.utils.DownloadError) as excinfo:
+            ydl_pool._extract_info_in_worker("failing", {}, "https://www.youtube.com/watch?v=dQw4w9WgXcQ")
+        assert "boom" in str(excinfo.value)
+        assert excinfo.value.exc_info is None
+        pickle.dumps(excinfo.value)
+    finally:
+        ydl_pool._worker_ydls.pop("failing", None)
+
+
+def test_ydl_worker_reraises_unexpected_error_with_traceback():
+    """yt-dlp以外の例外はトレースバックをメッセージに含めて返す"""
+    import pickle
+    from services import ydl_pool
+
+    class BrokenYoutubeDL:
+        params = {}
+
+        def extract_info(self, url, download=False):
+            raise ValueError("unexpected")
+
+    ydl_pool._worker_ydls["broken"] = BrokenYoutubeDL()
+    try:
+        with pytest.raises(RuntimeError) as excinfo:
+            ydl_pool._extract_info_in_worker("broken", {}, "https://www.youtube.com/watch?v=dQw4w9WgXcQ")
+        assert "Traceback" in str(excinfo.value)
+        assert "ValueError: unexpected" in str(excinfo.value)
+        pickle.dumps(excinfo.value)
+    finally:
+        ydl_pool._worker_ydls.pop("broken", None)
+
+
+def test_ydl_worker_saves_cookies(temp_dir):
+    """ワーカーは更新されたcookiesをファイルに書き戻す"""
+    from yt_dlp.cookies import YoutubeDLCookieJar
+    from services import ydl_pool
+
+    class CookieYoutubeDL:
+        params = {"cookiefile": os.path.join(temp_dir, "cookies.txt")}
+        cookiejar = YoutubeDLCookieJar()
+
+    ydl_pool._save_cookies(CookieYoutubeDL())
+    with open(CookieYoutubeDL.params["cookiefile"]) as f:
+        assert f.read().startswith("# Netscape HTTP Cookie File")
+    assert os.listdir(temp_dir) == ["cookies.txt"]
+
+
+def test_cookies_copied_at_startup_and_written_back_at_shutdown(temp_dir, monkeypatch):
+    """リポジトリのcookiesは起動時にコピーし、終了時にだけ書き戻す"""
+    from services import extractor as extractor_module
+    source_path = os.path.join(temp_dir, "cookies.firefox-private.txt")
+    runtime_path = os.path.join(temp_dir, "cookies.txt")
+    with open(source_path, "w") as f:
+        f.write("# Netscape HTTP Cookie File\noriginal\n")
+    monkeypatch.setattr(extractor_module, "COOKIES_SOURCE_PATH", source_path)
+    monkeypatch.setattr(extractor_module, "COOKIES_PATH", runtime_path)
+
+    extractor_module.startup_cookies()
+    with open(runtime_path) as f:
+        assert f.read().endswith("original\n")
+
+    # リクエスト中の更新は実行時用のコピーだけに反映される
+    with open(runtime_path, "w") as f:
+        f.write("# Netscape HTTP Cookie File\nrotated\n")
+    with open(source_path) as f:
+        assert f.read().endswith("original\n")
+
+    extractor_module.shutdown_cookies()
+    with open(source_path) as f:
+        assert f.read().endswith("rotated\n")
+    assert sorted(os.listdir(temp_dir)) == ["cookies.firefox-private.txt", "cookies.txt"]
+
+
+@pytest.mark.asyncio
+async def test_ydl_pool_restarts_after_broken_pool(monkeypatch):
+    """ワーカーが異常終了したプールは作り直して再実行する"""
+    from concurrent.futures import Executor, ThreadPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    from services import ydl_pool
+
+    class BrokenPool(Executor):
+        def submit(self, *args, **kwargs):
+            raise BrokenProcessPool("worker died")
+
+    broken = BrokenPool()
+    monkeypatch.setattr(ydl_pool, "_POOL", broken)
+    monkeypatch.setattr(ydl_pool, "ProcessPoolExecutor", lambda **kwargs: ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(ydl_pool, "_extract_info_in_worker", lambda profile, opts, url: {"id": "dQw4w9WgXcQ"})
+
+    assert await ydl_pool.extract_info("video", {}, "https://www.youtube.com/watch?v=dQw4w9WgXcQ") == {"id": "dQw4w9WgXcQ"}
+    assert ydl_pool._POOL is not broken
+    ydl_pool.shutdown_pool()
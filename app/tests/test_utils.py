@@ -1,6 +1,6 @@
 import pytest
 import os
-from utils.file_handler import cleanup_temp_file, get_file_size  # 相対インポートを絶対インポートに変更
+from utils.file_handler import cleanup_temp_file, get_file_size, safe_filename  # 相対インポートを絶対インポートに変更
 
 @pytest.mark.asyncio
 async def test_cleanup_temp_file(temp_dir):
@@ -28,4 +28,9 @@ def test_get_file_size(temp_dir):
 def test_get_file_size_nonexistent():
     """存在しないファイルのサイズ取得テスト"""
     size = get_file_size("nonexistent.txt")
-    assert size == 0
\ No newline at end of file
+    assert size == 0
+
+def test_safe_filename():
+    """ファイル名に使えない文字の除去テスト"""
+    assert safe_filename("Song: Title / Live!") == "Song Title  Live"
+    assert safe_filename("日本語の曲_01 - remix?  ") == "日本語の曲_01 - remix"
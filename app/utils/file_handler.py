@@ -1,9 +1,17 @@
 import os
+import re
 import logging
 from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+# 英数字（Unicode含む）・空白・ハイフン・アンダースコア以外を除去
+_TITLE_STRIP_RE = re.compile(r'[^\w \-]+')
+
+def safe_filename(title: str) -> str:
+    """タイトルをファイル名として安全な文字列に変換"""
+    return _TITLE_STRIP_RE.sub('', title).rstrip()
+
 async def cleanup_temp_file(file_path: Optional[str]) -> None:
     """一時ファイルを削除"""
     if file_path and os.path.exists(file_path):
@@ -19,4 +27,4 @@ def get_file_size(file_path: str) -> int:
         return os.path.getsize(file_path)
     except Exception as e:
         logger.error(f"Error getting file size: {str(e)}")
-        return 0
\ No newline at end of file
+        return 0